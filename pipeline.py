@@ -0,0 +1,414 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pandas as pd
+import datetime
+import functools
+import gspread
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+import logging
+import os
+import random
+import time
+import traceback
+import numpy as np
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+
+# Set up logging
+# Set LOG_LEVEL=WARNING to quiet scheduled runs, or DEBUG for per-row samples
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Configuration
+SPREADSHEET_ID = '1YVJKTo8PDKLFqp7azkY1XhqizFRxY0GZB4RvSQe7KEA'
+SERVICE_ACCOUNT_FILE = 'eth-options-key.json'
+PREVIOUS_ROWS = 300  # Tail of the sheet used for Open/OI_Change
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))  # Timestamps written to the sheet
+HEADERS = ['SYMBOL', 'Date', 'Time', 'Future_Price', 'Expiry_Date',
+           'Strike', 'Option_Type', 'Close', 'OI', 'Open', 'OI_Change']
+
+# Last data row per worksheet id, found by get_previous_data and advanced on append
+_last_row_cache = {}
+
+# Shared HTTP session: keep-alive connection pool plus retry with backoff
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+))
+SESSION.headers.update({'Accept': 'application/json'})
+
+# Sheets append retry: only statuses where the write was rejected, so a resend
+# cannot duplicate rows (a 500 may already have appended them)
+APPEND_ATTEMPTS = 5
+APPEND_RETRY_STATUSES = (429, 503)
+
+@functools.lru_cache(maxsize=1)
+def load_sheets_client():
+    """Load service-account credentials and authorize gspread once per process"""
+    scope = [
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/drive'
+    ]
+    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scope)
+    return creds, gspread.authorize(creds)
+
+def get_sheets_client():
+    """Initialize Google Sheets client (reused for the rest of the process)"""
+    try:
+        logger.info("🔑 Initializing Google Sheets client...")
+        creds, client = load_sheets_client()
+        
+        # The cached token can expire in a long-lived process
+        if creds.expired:
+            creds.refresh(Request())
+        
+        logger.info("✅ Google Sheets client initialized successfully")
+        return client
+    except Exception as e:
+        logger.error(f"❌ Error initializing sheets client: {e}")
+        return None
+
+@functools.lru_cache(maxsize=4)
+def open_worksheet(client, sheet_id, tab=None):
+    """Open a worksheet by spreadsheet id and tab title (first tab if None), cached per process"""
+    sheet = client.open_by_key(sheet_id)
+    return sheet.worksheet(tab) if tab else sheet.sheet1
+
+def clean_dataframe_for_json(df):
+    """Clean DataFrame to remove NaN and infinite values that cause JSON errors"""
+    # One mask covers missing values anywhere plus NaN/±inf in numeric columns
+    invalid = df.isna()
+    numeric = df.select_dtypes(include='number')
+    invalid[numeric.columns] = ~np.isfinite(numeric)
+    
+    # Replace them with None in a single pass (object dtype keeps None as-is)
+    return df.astype(object).mask(invalid, None)
+
+@functools.lru_cache(maxsize=256)
+def parse_ddmmyy(expiry_str):
+    """Parse a DDMMYY expiry string into a date, or None if invalid"""
+    try:
+        return datetime.date(2000 + int(expiry_str[4:6]), int(expiry_str[2:4]), int(expiry_str[:2]))
+    except ValueError:
+        return None
+
+def filter_strikes_by_percentage(future_price, strike_price, percentage=7):
+    """Check if strike is within ±percentage of future price (scalars or Series)"""
+    lower_bound = future_price * (1 - percentage / 100)
+    upper_bound = future_price * (1 + percentage / 100)
+    return (strike_price >= lower_bound) & (strike_price <= upper_bound)
+
+def fetch_eth_options_data(select_expiries, strike_percentage, label='ETH options'):
+    """Fetch ETH options for the expiries chosen by select_expiries, within ±strike_percentage of the future price"""
+    try:
+        logger.info(f"📡 Fetching {label} from India Delta Exchange API...")
+        
+        url = "https://api.india.delta.exchange/v2/tickers"
+        params = {
+            'contract_types': 'call_options,put_options',
+            'underlying_asset_symbols': 'ETH'
+        }
+        
+        # Fail fast on a dead connection, but allow a slow body (connect, read)
+        response = SESSION.get(url, params=params, timeout=(5, 30))
+        response.raise_for_status()
+        
+        # orjson parses the raw bytes directly and is several times faster than stdlib json
+        data = orjson.loads(response.content)
+        tickers = data.get('result', [])
+        logger.info(f"📊 Total ETH options fetched: {len(tickers)}")
+
+        if len(tickers) == 0:
+            logger.warning("⚠️ No ETH options found in API response")
+            return pd.DataFrame()
+
+        # Keep only ETH call/put tickers before building the frame; the prefix
+        # check rejects anything else on its first few characters
+        eth_tickers = [
+            t for t in tickers
+            if (t.get('symbol') or '').startswith(('C-ETH', 'P-ETH'))
+            and t.get('contract_type') in ('call_options', 'put_options')
+        ]
+        logger.info(f"🔎 ETH call/put tickers after pre-filter: {len(eth_tickers)}")
+        
+        # Build one frame from the kept tickers and parse it column-wise
+        raw = pd.DataFrame(eth_tickers).reindex(columns=[
+            'symbol', 'strike_price', 'contract_type', 'spot_price', 'mark_price', 'oi_contracts'
+        ])
+        
+        current_time = datetime.datetime.now(IST)
+        
+        symbols = raw['symbol'].astype(str)
+        contract_types = raw['contract_type'].astype(str)
+        future_prices = pd.to_numeric(raw['spot_price'], errors='coerce')
+        mark_prices = pd.to_numeric(raw['mark_price'], errors='coerce')
+        oi_contracts = pd.to_numeric(raw['oi_contracts'], errors='coerce').fillna(0)
+        
+        # Split each symbol (C-ETH-2500-271224) once; strike and expiry both come from its fields
+        symbol_parts = symbols.str.split('-')
+        
+        # A missing strike_price falls back to the strike field of the symbol
+        strikes = pd.to_numeric(raw['strike_price'], errors='coerce').fillna(
+            pd.to_numeric(symbol_parts.str[2], errors='coerce')
+        )
+        
+        # Get ETH spot price (every option ticker carries it) and calculate strike range
+        spot_prices = future_prices[future_prices.fillna(0) != 0]
+        eth_future_price = float(spot_prices.iloc[0]) if not spot_prices.empty else 0
+        
+        logger.info(f"💰 ETH Future Price: ${eth_future_price}")
+        
+        strike_lower = eth_future_price * (1 - strike_percentage / 100)
+        strike_upper = eth_future_price * (1 + strike_percentage / 100)
+        logger.info(f"🎯 Strike range filter: ${strike_lower:.2f} to ${strike_upper:.2f} (±{strike_percentage}%)")
+        
+        # Expiry is the DDMMYY last field of the symbol; only a handful of
+        # distinct suffixes exist, so the cached parser rarely runs
+        expiry_str = symbol_parts.str[-1]
+        has_expiry = (symbol_parts.str.len() >= 4) & (expiry_str.str.len() == 6)
+        expiry_dates = expiry_str.where(has_expiry).map(parse_ddmmyy, na_action='ignore')
+        
+        # Let the caller pick which expiries to collect
+        all_expiry_dates = expiry_dates.dropna().unique().tolist()
+        target_expiries = select_expiries(all_expiry_dates)
+        if not target_expiries:
+            logger.warning("⚠️ No valid expiry dates found")
+            return pd.DataFrame()
+        
+        logger.info(f"🗓️ Filtering for expiries: {target_expiries}")
+
+        # Rows missing a price or strike count as failed; missing OI counts as 0
+        parsed = strikes.notna() & future_prices.notna() & mark_prices.notna()
+        
+        # Filter by strike price range
+        in_range = filter_strikes_by_percentage(future_prices, strikes, strike_percentage)
+        filtered_by_strike = int((parsed & ~in_range).sum())
+        
+        failed = ~parsed | (in_range & expiry_dates.isna())
+        failed_parses = int(failed.sum())
+        for symbol in symbols[failed].head(3):
+            logger.warning("❌ Failed to parse %s", symbol)
+        
+        # Filter by expiry
+        keep = parsed & in_range & expiry_dates.isin(target_expiries)
+        successful_parses = int(keep.sum())
+        
+        logger.info(f"📊 Results: {successful_parses} successful, {failed_parses} failed")
+        logger.info(f"⚡ Filtered out {filtered_by_strike} options outside ±{strike_percentage}% strike range")
+
+        if successful_parses == 0:
+            logger.error(f"💀 No {label} were successfully parsed!")
+            return pd.DataFrame()
+
+        # Format each target expiry once; rows just look their label up
+        expiry_labels = {expiry: expiry.isoformat() for expiry in target_expiries}
+        
+        # Compact dtypes: Option_Type and Expiry_Date hold 2-3 distinct values and OI
+        # fits in int32; prices stay float64 so the values written to the sheet are exact
+        df = pd.DataFrame({
+            'SYMBOL': symbols[keep],
+            'Date': current_time.date().isoformat(),
+            'Time': current_time.time().isoformat(timespec='seconds'),
+            'Future_Price': future_prices[keep],
+            'Expiry_Date': expiry_dates[keep].map(expiry_labels).astype('category'),
+            'Strike': strikes[keep],
+            'Option_Type': pd.Categorical(np.where(contract_types[keep] == 'call_options', 'Call', 'Put')),
+            'Close': mark_prices[keep],
+            'OI': oi_contracts[keep].astype('int32'),
+            'Open': 0,        # Initialize as 0
+            'OI_Change': 0    # Initialize as 0
+        })
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for n, row in enumerate(df.head(5).itertuples(index=False), start=1):
+                logger.debug("✅ Parsed #%d: %s (Strike: %s, Expiry: %s)", n, row.SYMBOL, row.Strike, row.Expiry_Date)
+        
+        df_unique = df.drop_duplicates(subset=['SYMBOL'], keep='last')
+        
+        # Rows are sorted once, after Open/OI_Change are calculated
+        logger.info(f"📋 Final dataset: {len(df_unique)} {label} ({len(target_expiries)} expiries, ±{strike_percentage}% strikes)")
+        logger.info(f"📅 Expiries included: {sorted(df_unique['Expiry_Date'].unique())}")
+        logger.info(f"🎯 Strike range: ${df_unique['Strike'].min():.0f} to ${df_unique['Strike'].max():.0f}")
+        return df_unique
+
+    except Exception as e:
+        logger.error(f"❌ Error fetching ETH options data: {e}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        return pd.DataFrame()
+
+def get_tail_rows(worksheet, last_row):
+    """Read only the last PREVIOUS_ROWS data rows ending at last_row"""
+    start = max(2, last_row - PREVIOUS_ROWS + 1)
+    if last_row < start:
+        return start, []
+    rows = worksheet.get(f"A{start}:K{last_row}", value_render_option='UNFORMATTED_VALUE')
+    return start, rows
+
+def get_previous_data(worksheet):
+    """Get the last PREVIOUS_ROWS rows of previous data from Google Sheets"""
+    try:
+        # row_count is sheet metadata, so the bounded read needs no extra round-trip
+        last_row = worksheet.row_count
+        start, rows = get_tail_rows(worksheet, last_row)
+        
+        # row_count also counts blank grid rows below the data; if the window
+        # came back short, locate the real last row from column A and re-read
+        if start > 2 and len(rows) < last_row - start + 1:
+            last_row = len(worksheet.col_values(1))
+            start, rows = get_tail_rows(worksheet, last_row)
+        
+        # Trailing blank rows are trimmed by the API, so this is the real end of the data
+        _last_row_cache[worksheet.id] = start + len(rows) - 1
+        
+        if not rows:
+            return pd.DataFrame()
+        
+        # Type the columns used for calculations once, at read time
+        df = pd.DataFrame(rows, columns=HEADERS)
+        df['Close'] = pd.to_numeric(df['Close'], errors='coerce')
+        df['OI'] = pd.to_numeric(df['OI'], errors='coerce')
+        return df
+        
+    except Exception as e:
+        logger.error(f"Error getting previous data: {e}")
+        return pd.DataFrame()
+
+def order_rows(df):
+    """Put columns in sheet order and sort rows by Expiry Date and Symbol"""
+    # Time is the same for every row of a run, so it never breaks a tie
+    return df[HEADERS].sort_values(by=['Expiry_Date', 'SYMBOL']).reset_index(drop=True)
+
+def calculate_open_and_oi_change(current_df, previous_df):
+    """Calculate Open and OI_Change based on previous data - FIXED to avoid row duplication"""
+    if previous_df.empty:
+        # No previous data - set Open and OI_Change to 0
+        current_df['Open'] = 0
+        current_df['OI_Change'] = 0
+        logger.info("🆕 No previous data found - setting Open and OI_Change to 0")
+        return order_rows(current_df)
+
+    # Index the latest previous row per symbol (Close/OI are numeric from
+    # get_previous_data); missing previous values count as 0
+    prev = previous_df.drop_duplicates('SYMBOL', keep='last').set_index('SYMBOL')
+    prev_close = prev['Close'].fillna(0)
+    prev_oi = prev['OI'].fillna(0)
+    
+    logger.info(f"📚 Created lookup for {len(prev)} previous symbols")
+    
+    # Align previous values to current rows in one join; new symbols come back NaN
+    aligned = pd.DataFrame({'Close': prev_close, 'OI': prev_oi}).reindex(current_df['SYMBOL'])
+    matched = aligned['OI'].notna().to_numpy()
+    
+    # New symbols get Open and OI_Change of 0
+    current_df['Open'] = np.where(matched, aligned['Close'].to_numpy(), 0)
+    current_df['OI_Change'] = np.where(matched, current_df['OI'].to_numpy() - aligned['OI'].to_numpy(), 0)
+    
+    # Ensure proper column order and do the single sort of the pipeline
+    final_df = order_rows(current_df)
+    
+    # Log calculation summary
+    existing_symbols = int(matched.sum())
+    new_symbols = len(current_df) - existing_symbols
+    
+    logger.info(f"🔄 Calculated Open/OI_Change: {existing_symbols} existing, {new_symbols} new symbols")
+    
+    return final_df
+
+def append_rows_with_retry(worksheet, values, **kwargs):
+    """Call worksheet.append_rows, backing off with jitter on quota/unavailable errors"""
+    for attempt in range(1, APPEND_ATTEMPTS + 1):
+        try:
+            return worksheet.append_rows(values, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = e.response.status_code
+            if status not in APPEND_RETRY_STATUSES or attempt == APPEND_ATTEMPTS:
+                raise
+            delay = min(30, 2 ** attempt) + random.uniform(0, 1)
+            logger.warning(f"⏳ Sheets append returned {status}, retrying in {delay:.1f}s (attempt {attempt}/{APPEND_ATTEMPTS})")
+            time.sleep(delay)
+
+def append_to_sheets(df, worksheet):
+    """Append data to Google Sheets with proper data cleaning"""
+    try:
+        logger.info(f"📝 Attempting to append {len(df)} rows to {worksheet.title}...")
+        
+        # Clean DataFrame to fix JSON compliance issues
+        df_cleaned = clean_dataframe_for_json(df)
+        logger.info("🧹 Cleaned data for JSON compliance (removed NaN/inf values)")
+        
+        # Stream rows straight from the columns instead of building a 2D object array
+        values = list(map(list, df_cleaned.itertuples(index=False, name=None)))
+        
+        # Anchor the append at the known last data row so the server does not
+        # scan the whole sheet to find the end of the table
+        last_row = _last_row_cache.get(worksheet.id)
+        result = append_rows_with_retry(
+            worksheet,
+            values,
+            value_input_option='USER_ENTERED',
+            insert_data_option='INSERT_ROWS',
+            table_range=f"A{last_row}" if last_row else None
+        )
+        if last_row:
+            _last_row_cache[worksheet.id] = last_row + len(values)
+        logger.info(f"✅ Successfully appended {len(values)} rows to {worksheet.title}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error appending to sheets: {e}")
+        logger.error(f"Full error: {traceback.format_exc()}")
+        return False
+
+def run(select_expiries, strike_percentage, tab=None, label='ETH options'):
+    """Collect one ETH options snapshot and append it to the given tab (first tab if None)"""
+    logger.info(f"🚀 Starting {label} data collection - FIXED DUPLICATION & 0 VALUES")
+    
+    client = get_sheets_client()
+    if not client:
+        logger.error("Failed to initialize Google Sheets client")
+        return
+
+    try:
+        # The Delta API fetch and the Sheets reads are independent network
+        # waits, so fetch in a worker thread while the sheet is read here
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Fetch current ETH options data
+            current_future = executor.submit(fetch_eth_options_data, select_expiries, strike_percentage, label)
+            
+            worksheet = open_worksheet(client, SPREADSHEET_ID, tab)
+
+            # Get previous data for Open and OI_Change calculations
+            previous_df = get_previous_data(worksheet)
+            
+            current_df = current_future.result()
+        
+        if current_df.empty:
+            logger.warning(f"No {label} data collected")
+            return
+        
+        # Calculate Open and OI_Change - FIXED VERSION
+        final_df = calculate_open_and_oi_change(current_df, previous_df)
+        
+        # Log final data summary
+        logger.info(f"📊 Final data summary:")
+        logger.info(f"   Rows: {len(final_df)}")
+        logger.info(f"   Expiries: {sorted(final_df['Expiry_Date'].unique())}")
+        logger.info(f"   Strike range: ${final_df['Strike'].min():.0f} to ${final_df['Strike'].max():.0f}")
+        
+        # Append to Google Sheets
+        success = append_to_sheets(final_df, worksheet)
+        
+        if success:
+            logger.info(f"🎉 SUCCESS: Updated {len(final_df)} {label} (±{strike_percentage}% strikes, {final_df['Expiry_Date'].nunique()} expiries)")
+        else:
+            logger.error("💀 FAILED: Could not update Google Sheets")
+
+    except Exception as e:
+        logger.error(f"Error in main execution: {e}")
+        traceback.print_exc()
+
+